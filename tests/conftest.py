@@ -0,0 +1,44 @@
+"""Shared fixtures for the tests.
+
+Copyright © 2016-2018 Garrett Powell <garrett@gpowell.net>
+
+This file is part of zielen.
+
+zielen is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+zielen is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with zielen.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import pytest
+
+from zielen import containerbase
+
+
+@pytest.fixture
+def colliding_paths(monkeypatch):
+    """Give some paths the same ID until they're given salt.
+
+    Databases must be created after this fixture is used, since the hash
+    function is registered with sqlite when a connection is opened.
+
+    Returns:
+        The set of paths that collide with each other.
+    """
+    paths = {"documents/scans", "documents/report.odt", "pictures"}
+    hash_path = containerbase._hash_path
+
+    def colliding_hash_path(path, salt):
+        if path in paths and not salt:
+            return 0
+        return hash_path(path, salt)
+
+    monkeypatch.setattr(containerbase, "_hash_path", colliding_hash_path)
+    return paths
@@ -24,7 +24,7 @@ import tempfile
 import pytest
 
 from zielen.fstools import (
-    is_unsafe_symlink, scan_tree, symlink_tree, transfer_tree)
+    is_unsafe_symlink, scan_tree, stat_tree, symlink_tree, transfer_tree)
 
 TEST_FILE_PATHS = {
     "src/report.odt": "apple",
@@ -123,6 +123,33 @@ def test_rec_scan(files):
     assert {entry.path for entry in scan_tree("src")} == expected_output
 
 
+def test_stat_tree(files):
+    """A directory can be recursively scanned and stat'ed."""
+    expected_output = {
+        path: os.stat(path, follow_symlinks=False) for path in [
+            "src/report.odt", "src/scans", "src/scans/receipt.pdf"]}
+
+    assert {
+        entry.path: entry_stat
+        for entry, entry_stat in stat_tree("src")
+        } == expected_output
+
+
+def test_stat_tree_with_skip(files):
+    """Skipped directories and their contents are left out of a scan."""
+    expected_output = {"src/report.odt"}
+
+    assert {
+        entry.path for entry, entry_stat
+        in stat_tree("src", skip={"src/scans"})
+        } == expected_output
+
+
+def test_stat_tree_with_missing_dir(files):
+    """Scanning a directory that doesn't exist returns no entries."""
+    assert stat_tree("nonexistent") == []
+
+
 def test_is_unsafe_symlink(fs):
     """Relative symlinks are not considered unsafe."""
     fs.CreateFile("parent/target")
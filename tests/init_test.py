@@ -25,7 +25,7 @@ import textwrap
 import pytest
 
 from zielen.paths import get_program_dir
-from zielen.exceptions import InputError
+from zielen.exceptions import InputError, FileParseError
 from zielen.commands.init import InitCommand
 from zielen.profile import PathData as LocalPathData
 from zielen.userdata import PathData as RemotePathData
@@ -225,6 +225,20 @@ def test_if_local_dir_overlaps_another_profile(temp_dir):
         command2.main()
 
 
+def test_if_another_profile_config_is_invalid(temp_dir):
+    """An invalid config file in another profile raises an exception."""
+    create_files(temp_dir, "local", "remote", "local")
+    command = InitCommand("test", template="template")
+    command.main()
+    with open(command.profile.cfg_path, "a") as file:
+        file.write("LocalDir=relative/path\n")
+    create_files(temp_dir, "local2", "remote2", "local2")
+    command2 = InitCommand("test2", template="template")
+
+    with pytest.raises(FileParseError):
+        command2.main()
+
+
 def test_files_added_to_local_database(temp_dir):
     create_files(temp_dir, "local", "remote", "local")
     command = InitCommand("test", template="template")
@@ -19,12 +19,14 @@ along with zielen.  If not, see <http://www.gnu.org/licenses/>.
 """
 import os
 import re
+import glob
 
 import pytest
 
 from zielen.paths import get_program_dir
 from zielen.exceptions import FileParseError
-from zielen.profile import ProfileDBFile, PathData, ProfileConfigFile
+from zielen.profile import (
+    ProfileDBFile, PathData, ProfileConfigFile, ProfileExcludeFile)
 
 
 class TestProfileDBFile:
@@ -144,6 +146,124 @@ class TestProfileDBFile:
             "documents/scans/receipt.pdf": PathData(False, 5.0, False)}
         assert db.get_paths() == expected_output
 
+    @pytest.fixture
+    def nested_db(self):
+        database = ProfileDBFile(":memory:")
+        database.create()
+        database.add_paths([], ["a", "a/b", "a/b/c", "d"])
+        database.add_paths(["a/x.txt", "d/w.txt"], [], priority=1.0)
+        database.add_paths(["a/b/y.txt"], [], priority=2.0, local=False)
+        database.add_paths(["a/b/c/z.txt"], [], priority=4.0)
+        return database
+
+    def test_add_paths_updates_ancestors(self, nested_db):
+        """Directories sum the priorities of the files under them."""
+        expected_output = {
+            "a": PathData(True, 7.0, False),
+            "a/b": PathData(True, 6.0, False),
+            "a/b/c": PathData(True, 4.0, True),
+            "a/b/c/z.txt": PathData(False, 4.0, True),
+            "a/b/y.txt": PathData(False, 2.0, False),
+            "a/x.txt": PathData(False, 1.0, True),
+            "d": PathData(True, 1.0, True),
+            "d/w.txt": PathData(False, 1.0, True)}
+        assert nested_db.get_paths() == expected_output
+
+    def test_update_paths_updates_ancestors(self, nested_db):
+        """Updating a file updates every directory above it."""
+        nested_db.update_paths(["a/b/y.txt"], priority=0.5, local=True)
+        expected_output = {
+            "a": PathData(True, 5.5, True),
+            "a/b": PathData(True, 4.5, True),
+            "a/b/c": PathData(True, 4.0, True),
+            "d": PathData(True, 1.0, True)}
+        assert nested_db.get_paths(directory=True) == expected_output
+
+        nested_db.update_paths(["a/b/c/z.txt"], local=False)
+        expected_output = {
+            "a": PathData(True, 5.5, False),
+            "a/b": PathData(True, 4.5, False),
+            "a/b/c": PathData(True, 4.0, False),
+            "d": PathData(True, 1.0, True)}
+        assert nested_db.get_paths(directory=True) == expected_output
+
+    def test_rm_paths_updates_ancestors(self, nested_db):
+        """Removing a directory updates every directory above it."""
+        nested_db.rm_paths(["a/b/c"])
+        expected_output = {
+            "a": PathData(True, 3.0, False),
+            "a/b": PathData(True, 2.0, False),
+            "a/b/y.txt": PathData(False, 2.0, False),
+            "a/x.txt": PathData(False, 1.0, True),
+            "d": PathData(True, 1.0, True),
+            "d/w.txt": PathData(False, 1.0, True)}
+        assert nested_db.get_paths() == expected_output
+
+        nested_db.rm_paths(["a/b"])
+        expected_output = {
+            "a": PathData(True, 1.0, True),
+            "a/x.txt": PathData(False, 1.0, True)}
+        assert nested_db.get_paths(root="a") == expected_output
+
+    @pytest.fixture
+    def colliding_db(self, colliding_paths):
+        database = ProfileDBFile(":memory:")
+        database.create()
+        return database
+
+    def test_hash_collision_with_existing_path(self, colliding_db):
+        """A path that collides with one in the database gets a new ID."""
+        colliding_db.add_paths(["documents/report.odt"], ["documents"])
+        colliding_db.add_paths(
+            ["documents/scans/receipt.pdf"], ["documents/scans"],
+            priority=10.0, local=False)
+        expected_output = {
+            "documents": PathData(True, 10.0, False),
+            "documents/scans": PathData(True, 10.0, False),
+            "documents/report.odt": PathData(False, 0.0, True),
+            "documents/scans/receipt.pdf": PathData(False, 10.0, False)}
+        assert colliding_db.get_paths() == expected_output
+
+        expected_output = {
+            "documents/scans": PathData(True, 10.0, False),
+            "documents/scans/receipt.pdf": PathData(False, 10.0, False)}
+        assert colliding_db.get_paths(root="documents/scans") == (
+            expected_output)
+
+    def test_hash_collision_in_one_batch(self, colliding_db):
+        """Paths that collide with each other all get unique IDs."""
+        colliding_db.add_paths(
+            [
+                "documents/report.odt", "documents/scans/receipt.pdf",
+                "pictures/portrait.png"],
+            ["documents", "documents/scans", "pictures"], priority=1.0)
+        expected_output = {
+            "pictures": PathData(True, 1.0, True),
+            "pictures/portrait.png": PathData(False, 1.0, True)}
+        assert colliding_db.get_paths(root="pictures") == expected_output
+
+        colliding_db.rm_paths(["documents/scans"])
+        expected_output = {
+            "documents": PathData(True, 1.0, True),
+            "documents/report.odt": PathData(False, 1.0, True),
+            "pictures": PathData(True, 1.0, True),
+            "pictures/portrait.png": PathData(False, 1.0, True)}
+        assert colliding_db.get_paths() == expected_output
+
+    def test_shared_connection_stays_open(self, tmpdir):
+        """Closing one database object doesn't close it for others."""
+        db_path = str(tmpdir.join("local.db"))
+        database = ProfileDBFile(db_path)
+        database.create()
+        database.add_paths(["documents/report.odt"], [])
+        database.commit()
+        other_database = ProfileDBFile(db_path)
+        database.close()
+
+        assert other_database.get_path_info(
+            "documents/report.odt") == PathData(False, 0.0, True)
+        other_database.close()
+
 
 class TestProfileConfigFile:
     @pytest.fixture
@@ -199,3 +319,98 @@ class TestProfileConfigFile:
         cfg_file.raw_vals.update({"Foobar": ""})
         with pytest.raises(FileParseError):
             cfg_file.check_all(check_empty=False)
+
+    def test_changed_values_are_revalidated(self, cfg_file):
+        """Values changed since the last check are checked again."""
+        cfg_file.check_all(check_empty=False)
+        cfg_file.vals["StorageLimit"] = "abc"
+        with pytest.raises(FileParseError):
+            cfg_file.check_all(check_empty=False)
+
+    def test_directly_changed_values_are_revalidated(self, tmpdir):
+        """Values changed through raw_vals are checked again."""
+        cfg = ProfileConfigFile(str(tmpdir.join("config")))
+        cfg.raw_vals = {
+            "LocalDir": "/local",
+            "RemoteDir": "/remote",
+            "StorageLimit": "10GB"}
+        cfg.check_all()
+        cfg.raw_vals["StorageLimit"] = "abc"
+        with pytest.raises(FileParseError):
+            cfg.check_all()
+
+    def test_read_values_are_revalidated(self, tmpdir):
+        """Values changed in the file are checked again."""
+        cfg_path = tmpdir.join("config")
+        cfg_path.write(
+            "LocalDir=/local\nRemoteDir=/remote\nStorageLimit=10GB\n")
+        cfg = ProfileConfigFile(str(cfg_path))
+        cfg.read()
+        cfg.check_all()
+        assert cfg.vals["StorageLimit"] == "10GB"
+
+        cfg_path.write("StorageLimit=abc\n", mode="a")
+        cfg.read()
+        assert cfg.vals["StorageLimit"] == "abc"
+        with pytest.raises(FileParseError):
+            cfg.check_all()
+
+
+class TestProfileExcludeFile:
+    @pytest.fixture
+    def start_path(self, tmpdir):
+        test_dirs = [
+            "documents", "documents/scans", "documents/scans/old",
+            ".config", "documents/.git", "a"]
+        test_files = [
+            "a/b", "b", "ab", "]a", "ba]", "zx", "-", ".hidden",
+            "documents/a", "documents/.hidden", "documents/report.odt",
+            "documents/scans/receipt.pdf", "documents/scans/old/a",
+            "documents/.git/config", ".config/a"]
+
+        start_path = tmpdir.mkdir("start")
+        for path in test_dirs:
+            start_path.join(path).ensure(dir=True)
+        for path in test_files:
+            start_path.join(path).ensure()
+
+        return str(start_path)
+
+    @pytest.mark.parametrize(
+        "pattern", [
+            "/*", "*", "/?", "?", "/[ab]", "/[!a]*", "/[!]a]", "/[]a]",
+            "/[b]a]", "/[a-c]", "/[z-a]x", "/[!z-a]x", "/[--/]", "/[!-]",
+            "/**", "**", "/**/a", "/documents/**", "/documents/**/a",
+            "/a/**/**", "/**/**/a", "/[ab]/**", "/documents/**/", "**/",
+            "documents/**/old", "/documents/",
+            "/*/", "scans/", "/.*", ".*", "/documents/.*", "/*/.*",
+            "a", "*.odt", "old/*"
+            ])
+    def test_matches_like_glob(self, tmpdir, start_path, pattern):
+        """Patterns match the same paths that glob.glob() would match."""
+        exclude_file = ProfileExcludeFile(str(tmpdir.join("exclude")))
+        with open(exclude_file.path, "w") as file:
+            file.write(pattern + "\n")
+
+        if pattern.startswith("/"):
+            glob_str = os.path.join(start_path, pattern.lstrip("/"))
+        else:
+            glob_str = os.path.join(start_path, "**", pattern)
+        expected_output = {
+            os.path.relpath(path, start_path)
+            for path in glob.glob(glob_str, recursive=True)}
+
+        assert exclude_file.matches(start_path) == expected_output
+
+    def test_symlinked_dirs_are_not_descended(self, tmpdir, start_path):
+        """Patterns don't match files under a symlink to a directory."""
+        os.symlink(
+            os.path.join(start_path, "documents"),
+            os.path.join(start_path, "link"))
+        exclude_file = ProfileExcludeFile(str(tmpdir.join("exclude")))
+        with open(exclude_file.path, "w") as file:
+            file.write("report.odt\nlink\n")
+
+        assert exclude_file.matches(start_path) == {
+            "documents/report.odt", "link"}
+        assert "link/report.odt" not in exclude_file.all_matches(start_path)
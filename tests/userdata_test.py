@@ -197,3 +197,26 @@ class TestRemoteDBFile:
             "documents": PathData(True, 1495316810),
             "documents/report.odt": PathData(False, 1495316810)}
         assert db.get_paths() == expected_output
+
+    def test_hash_collision_in_one_batch(self, monkeypatch, colliding_paths):
+        """Paths that collide with each other all get unique IDs."""
+        monkeypatch.setattr("time.time", lambda: 1495316810)
+        database = RemoteDBFile(":memory:")
+        database.create()
+        database.add_paths(
+            [
+                "documents/report.odt", "documents/scans/receipt.png",
+                "pictures/portrait.png"],
+            ["documents", "documents/scans", "pictures"])
+        expected_output = {
+            "pictures": PathData(True, 1495316810),
+            "pictures/portrait.png": PathData(False, 1495316810)}
+        assert database.get_paths(root="pictures") == expected_output
+
+        database.rm_paths(["documents/scans"])
+        expected_output = {
+            "documents": PathData(True, 1495316810),
+            "documents/report.odt": PathData(False, 1495316810),
+            "pictures": PathData(True, 1495316810),
+            "pictures/portrait.png": PathData(False, 1495316810)}
+        assert database.get_paths() == expected_output
@@ -21,7 +21,6 @@ import signal
 import sys
 import os
 import argparse
-import pkg_resources
 from textwrap import dedent
 
 from linotype import Item, DefStyle
@@ -29,6 +28,7 @@ from linotype import Item, DefStyle
 from zielen.commandbase import Command
 from zielen.daemon import Daemon
 from zielen.exceptions import ProgramError, InputError
+from zielen.utils import get_version
 from zielen.commands.emptytrash import EmptyTrashCommand
 from zielen.commands.init import InitCommand
 from zielen.commands.list import ListCommand
@@ -190,9 +190,7 @@ class VersionAction(argparse.Action):
         super().__init__(nargs=nargs, **kwargs)
 
     def __call__(self, parser, namespace, values, option_string=None) -> None:
-        print(
-            "zielen",
-            pkg_resources.get_distribution("zielen").version)
+        print("zielen", get_version())
         parser.exit()
 
 
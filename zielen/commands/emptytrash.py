@@ -39,12 +39,12 @@ class EmptyTrashCommand(Command):
         self.setup_profile()
 
         files_deleted = 0
-        for path in os.scandir(self.remote_dir.trash_dir):
+        for entry in os.scandir(self.remote_dir.trash_dir):
             try:
-                os.remove(path)
-                files_deleted += 1
-            except IsADirectoryError:
-                shutil.rmtree(path)
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
                 files_deleted += 1
             except FileNotFoundError:
                 pass
@@ -30,7 +30,7 @@ from zielen.exceptions import InputError
 from zielen.fstools import check_dir
 from zielen.filelogic import FilesManager
 from zielen.userdata import LocalSyncDir, RemoteSyncDir
-from zielen.profile import Profile
+from zielen.profile import Profile, ProfileConfigFile
 from zielen.commandbase import Command, unlock
 
 
@@ -38,12 +38,17 @@ class InitCommand(Command):
     """Run the "init" command.
 
     Attributes:
+        SPACE_REGEX: A regex object that represents whitespace.
+        NAME_REGEX: A regex object that represents a valid profile name.
         profile_input: The "name" argument for the command.
         profile: The currently selected profile.
         exclude: The argument for the "--exclude" option.
         template: The argument for the "--template" option.
         add_remote: The "--add-remote" options was given.
     """
+    SPACE_REGEX = re.compile(r"\s+")
+    NAME_REGEX = re.compile(r"^[\w-]+$")
+
     def __init__(self, profile_input: str, exclude=None, template=None,
                  add_remote=False) -> None:
         super().__init__()
@@ -75,9 +80,9 @@ class InitCommand(Command):
                 pass
 
         # Check that value of profile name is valid.
-        if re.search(r"\s+", self.profile_input):
+        if self.SPACE_REGEX.search(self.profile_input):
             raise InputError("profile name must not contain spaces")
-        elif not re.search(r"^[\w-]+$", self.profile_input):
+        elif not self.NAME_REGEX.search(self.profile_input):
             raise InputError(
                 "profile name must not contain special symbols")
 
@@ -191,8 +196,9 @@ class InitCommand(Command):
             An error message if the local directory is invalid and None
             otherwise.
         """
-        common_path = os.path.commonpath([dir_path, get_program_dir()])
-        if common_path in [dir_path, get_program_dir()]:
+        program_dir = get_program_dir()
+        common_path = os.path.commonpath([dir_path, program_dir])
+        if common_path in [dir_path, program_dir]:
             return "local directory must not contain zielen config files"
 
         overlap_profiles = []
@@ -200,10 +206,18 @@ class InitCommand(Command):
             if profile is self.profile or not os.path.isfile(profile.cfg_path):
                 continue
 
-            profile.read()
-
-            common_path = os.path.commonpath([profile.local_path, dir_path])
-            if common_path in [profile.local_path, dir_path]:
+            # Only the local directory of the other profile is needed, so
+            # read just its config file. This skips reading the info file,
+            # but the config file is still checked so that an invalid config
+            # is reported and LocalDir is known to be an absolute path.
+            config_file = ProfileConfigFile(profile.cfg_path)
+            config_file.read()
+            config_file.check_all()
+            local_dir = config_file.vals["LocalDir"]
+
+            local_path = os.path.normpath(os.path.expanduser(local_dir))
+            common_path = os.path.commonpath([local_path, dir_path])
+            if common_path in [local_path, dir_path]:
                 overlap_profiles.append(name)
 
         if overlap_profiles:
@@ -20,14 +20,57 @@ along with zielen.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import re
 import json
+import atexit
 import sqlite3
 import contextlib
 import hashlib
-from typing import List, Generator, Iterable
+import collections
+from typing import List, Generator, Iterable, Optional
 
 from zielen.exceptions import FileParseError, RemoteError
 from zielen.utils import secure_string
 
+# Open database connections are shared between all objects for the same
+# database file. The keys are the paths of the database files.
+_connections = {}
+
+# The number of objects holding each open connection. A connection is only
+# closed once every object using it has released it.
+_connection_refs = collections.Counter()
+
+
+def _close_connections() -> None:
+    """Close all open database connections."""
+    for conn in _connection_refs:
+        conn.close()
+    _connections.clear()
+    _connection_refs.clear()
+
+
+atexit.register(_close_connections)
+
+
+def _hash_path(path: str, salt: Optional[str]) -> int:
+    """Return a 64-bit integer derived from a file path and optional salt.
+
+    This is also registered as the SQL function 'path_id'.
+
+    Args:
+        path: The file path from which to derive the ID.
+        salt: The salt for the file path from the 'collisions' table, or None.
+
+    Returns:
+        A signed 64-bit integer.
+    """
+    hash_string = path
+    if salt:
+        hash_string += salt
+
+    path_hash = hashlib.sha256()
+    path_hash.update(hash_string.encode())
+    return int.from_bytes(
+        path_hash.digest()[:8], byteorder="big", signed=True)
+
 
 class ConfigFile:
     """Parse a configuration file.
@@ -133,24 +176,20 @@ class SyncDBFile:
         path: The path of the database file.
 
     Attributes:
+        _CONNECTION_PRAGMAS: A script of pragmas that must be set every time a
+            connection to the database is opened.
         path: The path of the database file.
         _conn: The sqlite connection object for the database.
         _cur: The sqlite cursor object for the connection.
     """
+    _CONNECTION_PRAGMAS = """\
+        PRAGMA foreign_keys = ON;
+        """
+
     def __init__(self, path: str) -> None:
         self.path = path
         if os.path.isfile(self.path):
-            self._conn = sqlite3.connect(
-                self.path,
-                detect_types=sqlite3.PARSE_DECLTYPES,
-                isolation_level="DEFERRED")
-            self._conn.create_function("gen_salt", 0, lambda: secure_string(8))
-
-            self._cur = self._conn.cursor()
-            self._cur.arraysize = 20
-            self._cur.executescript("""\
-                PRAGMA foreign_keys = ON;
-                """)
+            self._connect()
         else:
             self._conn = None
             self._cur = None
@@ -159,6 +198,94 @@ class SyncDBFile:
         sqlite3.register_adapter(bool, int)
         sqlite3.register_converter("BOOL", lambda x: bool(int(x)))
 
+    def _connect(self) -> None:
+        """Open a connection to the database and create a cursor.
+
+        If there is already an open connection to the database file, it is
+        reused. This keeps the sqlite page cache warm and means that the
+        connection pragmas only need to be set once. Objects sharing a
+        connection also share its transaction. Every call must be paired with
+        a call to _release().
+        """
+        conn = _connections.get(self.path)
+        if conn is None:
+            # Statements are cached by their SQL text, so the cache needs to
+            # be large enough to hold every query that is run repeatedly.
+            # Write transactions take the write lock as soon as they begin so
+            # that a batch of changes never has to wait to upgrade its lock
+            # partway through.
+            conn = sqlite3.connect(
+                self.path,
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                isolation_level="IMMEDIATE",
+                cached_statements=200)
+            conn.create_function("gen_salt", 0, lambda: secure_string(8))
+            conn.create_function("path_id", 2, _hash_path)
+            conn.executescript(self._CONNECTION_PRAGMAS)
+
+            # This table is used for staging new paths so that they can be
+            # added to the database in bulk.
+            conn.execute("""\
+                CREATE TEMP TABLE IF NOT EXISTS incoming (
+                    path        TEXT    NOT NULL,
+                    parent      TEXT    NOT NULL,
+                    directory   BOOL    NOT NULL,
+                    depth       INT     NOT NULL,
+                    id          INT,
+                    parent_id   INT,
+                    PRIMARY KEY (path) ON CONFLICT IGNORE
+                );
+                """)
+            conn.execute("""\
+                CREATE INDEX IF NOT EXISTS temp.incoming_id
+                ON incoming (id);
+                """)
+            conn.execute("""\
+                CREATE TEMP TABLE IF NOT EXISTS ancestors (
+                    id          INT     NOT NULL,
+                    PRIMARY KEY (id) ON CONFLICT IGNORE
+                ) WITHOUT ROWID;
+                """)
+
+            # Every in-memory database is a separate database.
+            if self.path != ":memory:":
+                _connections[self.path] = conn
+
+        _connection_refs[conn] += 1
+        self._conn = conn
+        self._cur = self._conn.cursor()
+        # Results are usually read in full, so fetch them in large batches
+        # to cut down on the number of round trips through the sqlite module.
+        self._cur.arraysize = 1000
+
+    def _release(self) -> None:
+        """Release the connection to the database.
+
+        The connection is only closed once no other objects are using it.
+        """
+        conn = self._conn
+        if conn is None:
+            return
+        self._conn = None
+        self._cur = None
+
+        _connection_refs[conn] -= 1
+        if _connection_refs[conn] <= 0:
+            del _connection_refs[conn]
+            if _connections.get(self.path) is conn:
+                del _connections[self.path]
+            conn.close()
+
+    def _reconnect(self) -> None:
+        """Open a new connection to the database and share it.
+
+        Any connection that was shared before is no longer handed out, but
+        other objects holding it can keep using it until they release it.
+        """
+        self._release()
+        _connections.pop(self.path, None)
+        self._connect()
+
     @contextlib.contextmanager
     def _transact(self) -> Generator[None, None, None]:
         """Check if database file exists and commit the transaction on exit.
@@ -173,18 +300,19 @@ class SyncDBFile:
 
     def _mark_directory(self, paths: Iterable[str]) -> None:
         """Mark paths as directories."""
-        # A generator expression can't be used here because recursive use of
-        # cursors is not allowed.
-        nodes_values = [{
-            "path_id": self._get_path_id(path)}
-            for path in paths]
-
-        self._cur.executemany("""\
+        # The IDs are generated in SQL so that the paths can be passed in as
+        # a single JSON array instead of being bound one row at a time.
+        self._cur.execute("""\
             UPDATE nodes
             SET directory = 1
             WHERE directory = 0
-            AND id = :path_id;
-            """, nodes_values)
+            AND id IN (
+                SELECT path_id(j.value, (
+                    SELECT salt
+                    FROM collisions
+                    WHERE path = j.value))
+                FROM json_each(:paths) AS j);
+            """, {"paths": json.dumps(list(paths))})
 
     def _get_path_id(self, path: str) -> int:
         """Return a 64-bit integer derived from the given file path.
@@ -205,19 +333,158 @@ class SyncDBFile:
             """, {"path": path})
 
         salt = self._cur.fetchone()
-        hash_string = path
-        if salt:
-            hash_string += salt[0]
+        return _hash_path(path, salt[0] if salt else None)
+
+    def _stage_paths(
+            self, files: Iterable[str], dirs: Iterable[str]) -> List[int]:
+        """Load new file paths into the 'incoming' table and assign their IDs.
+
+        The 'incoming' table is a temporary table that is cleared each time
+        this method is called. If there are any hash collisions between the
+        new paths and paths already in the database or each other, salt is
+        generated for the new paths and their IDs are regenerated.
+
+        Args:
+            files: The paths of regular files to stage.
+            dirs: The paths of directories to stage.
+
+        Returns:
+            A sorted list of the depths of the staged paths.
+        """
+        # Deduplicate the paths and record whether each one is a directory in
+        # a single pass.
+        is_directory = dict.fromkeys(files, False)
+        is_directory.update(dict.fromkeys(dirs, True))
+
+        incoming_vals = []
+        depths = set()
+        for path, directory in is_directory.items():
+            depth = path.count(os.sep)
+            depths.add(depth)
+            incoming_vals.append({
+                "path": path,
+                "parent": os.path.dirname(path),
+                "directory": directory,
+                "depth": depth})
+
+        # The IDs are generated as the paths are inserted. Paths at the root
+        # of the tree don't have a parent.
+        self._cur.execute("DELETE FROM incoming;")
+        self._cur.executemany("""\
+            INSERT INTO incoming (
+                path, parent, directory, depth, id, parent_id)
+            VALUES (
+                :path, :parent, :directory, :depth,
+                path_id(:path, (
+                    SELECT salt
+                    FROM collisions
+                    WHERE path = :path)),
+                CASE :parent
+                    WHEN '' THEN NULL
+                    ELSE path_id(:parent, (
+                        SELECT salt
+                        FROM collisions
+                        WHERE path = :parent))
+                    END);
+            """, incoming_vals)
+
+        while True:
+            # If there are any hash collisions with paths already in the
+            # database or with other new paths, generate salt for the new
+            # paths. Paths that are already in the database keep their IDs.
+            # This almost never happens, so the IDs are only regenerated when
+            # it does.
+            self._cur.execute("""\
+                INSERT OR REPLACE INTO collisions (path, salt)
+                SELECT i.path, gen_salt()
+                FROM incoming AS i
+                WHERE NOT EXISTS (
+                    SELECT 1
+                    FROM nodes AS n
+                    WHERE n.id = i.id
+                    AND n.path = i.path)
+                AND (
+                    EXISTS (
+                        SELECT 1
+                        FROM nodes AS n
+                        WHERE n.id = i.id)
+                    OR EXISTS (
+                        SELECT 1
+                        FROM incoming AS o
+                        WHERE o.id = i.id
+                        AND o.path < i.path));
+                """)
+            if self._cur.rowcount <= 0:
+                break
+
+            self._cur.execute("""\
+                UPDATE incoming
+                SET id = path_id(path, (
+                        SELECT salt
+                        FROM collisions
+                        WHERE collisions.path = incoming.path)),
+                    parent_id = CASE parent
+                        WHEN '' THEN NULL
+                        ELSE path_id(parent, (
+                            SELECT salt
+                            FROM collisions
+                            WHERE collisions.path = incoming.parent))
+                        END
+                WHERE path IN (SELECT path FROM collisions)
+                OR parent IN (SELECT path FROM collisions);
+                """)
+
+        return sorted(depths)
+
+    def _stage_ancestors(self, paths: Iterable[str]) -> None:
+        """Load the IDs of paths and their ancestors into a temporary table.
 
-        path_hash = hashlib.sha256()
-        path_hash.update(hash_string.encode())
-        return int.from_bytes(
-            path_hash.digest()[:8], byteorder="big", signed=True)
+        The 'ancestors' table is a temporary table that is cleared each time
+        this method is called. Paths that aren't in the database are ignored.
+
+        Args:
+            paths: The paths to get the ancestors of.
+        """
+        self._cur.execute("DELETE FROM ancestors;")
+        self._cur.execute("""\
+            INSERT INTO ancestors (id)
+            SELECT c.ancestor
+            FROM closure AS c
+            WHERE c.descendant IN (
+                SELECT path_id(j.value, (
+                    SELECT salt
+                    FROM collisions
+                    WHERE path = j.value))
+                FROM json_each(:paths) AS j);
+            """, {"paths": json.dumps(list(paths))})
+
+    def _insert_closure(self, depths: Iterable[int]) -> None:
+        """Add the staged paths in the 'incoming' table to the closure table.
+
+        A path can't be added to the closure table until its parent directory
+        has been added, so this inserts the paths one level of the tree at a
+        time.
+
+        Args:
+            depths: The depths of the staged paths in trunk-to-leaf order.
+        """
+        for depth in depths:
+            self._cur.execute("""\
+                INSERT INTO closure (ancestor, descendant, depth)
+                SELECT c.ancestor, i.id, c.depth + 1
+                FROM incoming AS i
+                JOIN closure AS c
+                ON (c.descendant = i.parent_id)
+                WHERE i.depth = :depth
+                UNION ALL SELECT id, id, 0
+                FROM incoming
+                WHERE depth = :depth;
+                """, {"depth": depth})
 
     def commit(self) -> None:
         """Commit the database transaction."""
         self._conn.commit()
 
     def close(self) -> None:
-        """Close the database connection."""
-        self._conn.close()
+        """Close the database connection if no other objects are using it."""
+        self._release()
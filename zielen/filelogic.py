@@ -671,16 +671,8 @@ class FilesManager:
 
         # Compute files that need to be deleted, not including the files
         # under selected directories.
-        local_del_paths = known_paths - remote_paths
-        remote_del_paths = known_paths - local_paths
-        for path in local_del_paths.copy():
-            sub_paths = set(self.profile.get_paths(root=path).keys())
-            sub_paths.remove(path)
-            local_del_paths -= sub_paths
-        for path in remote_del_paths.copy():
-            sub_paths = set(self.remote_dir.get_paths(root=path).keys())
-            sub_paths.remove(path)
-            remote_del_paths -= sub_paths
+        local_del_paths = self._rm_sub_paths(known_paths - remote_paths)
+        remote_del_paths = self._rm_sub_paths(known_paths - local_paths)
 
         # Compute files to be moved to the trash.
         if self.profile.use_trash:
@@ -692,6 +684,31 @@ class FilesManager:
 
         return DeletedPaths(local_del_paths, remote_del_paths, trash_paths)
 
+    @staticmethod
+    def _rm_sub_paths(paths: Set[str]) -> Set[str]:
+        """Remove paths that are under other paths in the same set.
+
+        This only compares the paths themselves, so it doesn't need to query
+        the databases for the contents of each directory.
+
+        Args:
+            paths: The relative paths to filter.
+
+        Returns:
+            The paths that aren't under any other path in the input.
+        """
+        top_paths = set()
+        for path in paths:
+            parent = os.path.dirname(path)
+            while parent:
+                if parent in paths:
+                    break
+                parent = os.path.dirname(parent)
+            else:
+                top_paths.add(path)
+
+        return top_paths
+
     def _rename_files(
             self, path_pairs: Iterable[Tuple[str, str]],
             parent_dir: str) -> None:
@@ -861,10 +878,13 @@ class FilesManager:
         """Delete old files from the remote trash directory."""
         cutoff_time = time.time() - self.profile.cleanup_period
         for entry in os.scandir(self.remote_dir.trash_dir):
-            if entry.stat().st_mtime <= cutoff_time:
-                try:
+            # The mtime of files is updated without following symlinks when
+            # they're moved to the trash. The file type is usually known from
+            # the directory listing, so checking it doesn't need a system call.
+            if entry.stat(follow_symlinks=False).st_mtime <= cutoff_time:
+                if entry.is_dir(follow_symlinks=False):
                     shutil.rmtree(entry.path)
-                except NotADirectoryError:
+                else:
                     os.remove(entry.path)
 
     def get_excluded_size(self) -> int:
@@ -873,7 +893,8 @@ class FilesManager:
         Returns:
             The disk usage as a number of bytes.
         """
+        local_stats = self.local_dir.scan_paths()
         total_excluded_size = sum(
-            self.local_dir.scan_paths()[path].st_blocks * 512
+            local_stats[path].st_blocks * 512
             for path in self.profile.all_exclude_matches(self.local_dir.path))
         return total_excluded_size
@@ -19,10 +19,11 @@ along with zielen.  If not, see <http://www.gnu.org/licenses/>.
 """
 import os
 import sys
+import stat
 import time
 import shutil
 import tempfile
-from typing import Iterable, Optional, Set
+from typing import Iterable, Optional, Set, List, Tuple
 
 from zielen.utils import shell_cmd, ProgressBar
 from zielen.exceptions import FileTransferError
@@ -188,10 +189,58 @@ def scan_tree(path: str):
     Yields:
         An os.DirEntry object for each file in the tree.
     """
-    for entry in os.scandir(path):
-        yield entry
-        if entry.is_dir(follow_symlinks=False):
-            yield from scan_tree(entry.path)
+    # An explicit stack of directory iterators is used instead of recursion so
+    # that each entry isn't passed up through a chain of nested generators.
+    dir_stack = [os.scandir(path)]
+    while dir_stack:
+        for entry in dir_stack[-1]:
+            yield entry
+            if entry.is_dir(follow_symlinks=False):
+                dir_stack.append(os.scandir(entry.path))
+                break
+        else:
+            dir_stack.pop()
+
+
+def stat_tree(
+        path: str, skip=frozenset()
+        ) -> List[Tuple[os.DirEntry, os.stat_result]]:
+    """Recursively scan a directory tree and stat each file in it.
+
+    Symlinks are not followed, and files or directories that are removed
+    during the scan are left out. The entries are not returned in any
+    particular order.
+
+    Args:
+        path: The path of the directory to scan.
+        skip: The paths of files to leave out of the output. Directories with
+            these paths are not scanned, so none of their contents are
+            included either.
+
+    Returns:
+        A list of tuples containing an os.DirEntry object and the
+        os.stat_result of that entry for each file in the tree.
+    """
+    output = []
+    dir_stack = [path]
+    while dir_stack:
+        try:
+            dir_entries = os.scandir(dir_stack.pop())
+        except FileNotFoundError:
+            continue
+
+        for entry in dir_entries:
+            if entry.path in skip:
+                continue
+            try:
+                entry_stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            output.append((entry, entry_stat))
+            if stat.S_ISDIR(entry_stat.st_mode):
+                dir_stack.append(entry.path)
+
+    return output
 
 
 def is_unsafe_symlink(link_path: str, parent_path: str) -> bool:
@@ -246,12 +295,28 @@ def check_dir(path: str, expect_empty: bool) -> Optional[str]:
     Returns:
         An error message if the directory is not valid, and None otherwise.
     """
-    if os.path.exists(path):
-        if os.path.isdir(path):
+    # Stat the path once instead of checking whether it exists and whether
+    # it's a directory separately.
+    try:
+        path_stat = os.stat(path)
+    except (OSError, ValueError):
+        path_stat = None
+
+    if path_stat is not None:
+        if stat.S_ISDIR(path_stat.st_mode):
             if not os.access(path, os.W_OK):
                 return "must be a directory with write access"
-            elif expect_empty and list(os.scandir(path)):
-                return "must be an empty directory"
+            elif expect_empty:
+                # Only the first entry is read instead of the whole directory.
+                # The iterator only has a close() method on Python 3.6+.
+                entries = os.scandir(path)
+                try:
+                    if next(entries, None) is not None:
+                        return "must be an empty directory"
+                finally:
+                    close = getattr(entries, "close", None)
+                    if close is not None:
+                        close()
         else:
             return "must be a directory"
     else:
@@ -21,30 +21,43 @@ import os
 import re
 import sys
 import glob
+import fnmatch
+import shutil
+import json
 import uuid
 import getpass
-import sqlite3
 import datetime
+import functools
 import textwrap
 import readline  # This is not unused. Importing it adds features to input().
 import collections
 from typing import (
     Any, Iterable, Generator, Dict, NamedTuple, Optional, Union, Set, List)
 
-import pkg_resources
-
 from zielen.paths import get_xdg_data_home, get_profiles_dir
 from zielen.containerbase import JSONFile, ConfigFile, SyncDBFile
 from zielen.fstools import scan_tree
 from zielen.utils import (
-    DictProperty, secure_string, set_no_autocomplete, set_path_autocomplete,
-    get_path_ancestry)
+    DictProperty, CachedProperty, set_no_autocomplete, set_path_autocomplete,
+    get_version)
 from zielen.exceptions import FileParseError
 
 PathData = NamedTuple(
     "PathData", [("directory", bool), ("priority", float), ("local", bool)])
 
 
+def _is_abs_path(value: str) -> bool:
+    """Return whether a string is an absolute path or starts with a tilde."""
+    return value.startswith(("/", "~/"))
+
+
+def _is_int(value: str) -> bool:
+    """Return whether a string represents an integer."""
+    if value.startswith("-"):
+        value = value[1:]
+    return value.isdecimal()
+
+
 class Profile:
     """Get information about a profile and its contents.
 
@@ -57,9 +70,12 @@ class Profile:
         _info_file: An object for the JSON file for profile metadata.
         _db_file: An object for the file priority database.
         _cfg_file: An object for the profile's configuration file.
+        _cached_vals: A dict of values that are parsed from the config file,
+            which is cleared whenever the config file is read.
     """
     def __init__(self, name: str) -> None:
         self.name = name
+        self._cached_vals = {}
         self.path = os.path.join(get_profiles_dir(), self.name)
         self._exclude_file = ProfileExcludeFile(
             os.path.join(self.path, "exclude"))
@@ -89,6 +105,7 @@ class Profile:
         # read first. 
         self._info_file.read()
         self._cfg_file.read()
+        self._cached_vals.clear()
         self._cfg_file.check_all()
         self._exclude_file.reset()
 
@@ -122,6 +139,8 @@ class Profile:
             self._cfg_file.write(os.path.join(
                 sys.prefix, "share/zielen/config-template"))
 
+        self._cached_vals.clear()
+
     def write(self) -> None:
         """Write data to persistent storage."""
         self._info_file.write()
@@ -141,20 +160,27 @@ class Profile:
         self._info_file.vals["Status"] = value
 
     @staticmethod
+    @functools.lru_cache(maxsize=8)
     def _convert_epoch(timestamp: str) -> float:
         """Convert a human-readable timestamp to epoch time."""
-        return datetime.datetime.strptime(
-            timestamp, "%Y-%m-%dT%H:%M:%S.%f").replace(
+        # The timestamp is always in the fixed-width format written by
+        # _convert_timestamp(), so it can be sliced instead of using the much
+        # slower strptime().
+        return datetime.datetime(
+            int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+            int(timestamp[11:13]), int(timestamp[14:16]),
+            int(timestamp[17:19]), int(timestamp[20:26]),
             tzinfo=datetime.timezone.utc).timestamp()
 
     @staticmethod
     def _convert_timestamp(epoch: float) -> str:
         """Convert an epoch timestamp to a human-readable one."""
-        # Use strftime() instead of isoformat() because the latter
-        # doesn't print the decimal point if the microsecond is 0,
-        # which would prevent it from being parsed by strptime().
-        return datetime.datetime.utcfromtimestamp(
-            epoch).strftime("%Y-%m-%dT%H:%M:%S.%f")
+        # Format the timestamp manually instead of using isoformat() because
+        # the latter doesn't print the decimal point if the microsecond is 0.
+        time = datetime.datetime.utcfromtimestamp(epoch)
+        return "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}.{:06d}".format(
+            time.year, time.month, time.day, time.hour, time.minute,
+            time.second, time.microsecond)
 
     @property
     def last_sync(self) -> float:
@@ -205,45 +231,41 @@ class Profile:
     def add_remote(self, value: bool) -> None:
         self._info_file.vals["InitOptions"]["add_remote"] = value
 
-    @property
+    @CachedProperty
     def local_path(self) -> str:
         """The absolute path of the local directory."""
-        return os.path.expanduser(
-            os.path.normpath(self._cfg_file.vals["LocalDir"]))
+        return os.path.normpath(
+            os.path.expanduser(self._cfg_file.vals["LocalDir"]))
 
-    @property
+    @CachedProperty
     def remote_path(self) -> str:
         """The absolute path of the remote directory."""
-        return os.path.expanduser(
-            os.path.normpath(self._cfg_file.vals["RemoteDir"]))
+        return os.path.normpath(
+            os.path.expanduser(self._cfg_file.vals["RemoteDir"]))
 
-    @property
+    @CachedProperty
     def storage_limit(self) -> int:
         """The number of bytes of data to keep in the local directory."""
-        num, prefix, unit = re.findall(
-            r"^([0-9]+)\s*([KMG])(B|iB)?$",
-            self._cfg_file.vals["StorageLimit"], re.IGNORECASE)[0]
+        # The value was validated with the same regex when the config file
+        # was checked.
+        num, prefix, unit = self._cfg_file.SIZE_REGEX.fullmatch(
+            self._cfg_file.vals["StorageLimit"]).groups()
 
-        if unit == "iB" or not unit:
-            base = 1024
-        elif unit == "B":
+        if unit and unit.upper() == "B":
             base = 1000
+        else:
+            base = 1024
 
-        if prefix in ["k", "K"]:
-            exponent = 1
-        elif prefix == "M":
-            exponent = 2
-        elif prefix == "G":
-            exponent = 3
+        exponent = {"K": 1, "M": 2, "G": 3}[prefix.upper()]
 
         return int(num) * base**exponent
 
-    @property
+    @CachedProperty
     def sync_interval(self) -> int:
         """The number of seconds the daemon will wait between syncs."""
         return int(self._cfg_file.vals["SyncInterval"]) * 60
 
-    @property
+    @CachedProperty
     def cleanup_period(self) -> Optional[int]:
         """The number of seconds before files in the trash are deleted."""
         value = self._cfg_file.vals["TrashCleanupPeriod"]
@@ -252,7 +274,7 @@ class Profile:
         else:
             return int(value) * 60 * 60 * 24
 
-    @property
+    @CachedProperty
     def priority_half_life(self) -> int:
         """The half-life of file priorities in seconds."""
         return int(self._cfg_file.vals["PriorityHalfLife"]) * 60**2
@@ -264,17 +286,17 @@ class Profile:
         elif value in self._cfg_file.FALSE_VALS:
             return False
 
-    @property
+    @CachedProperty
     def use_trash(self) -> bool:
         """Permanently delete remote files that were deleted locally."""
         return self._convert_bool(self._cfg_file.vals["UseTrash"])
 
-    @property
+    @CachedProperty
     def inflate_priority(self) -> bool:
         """Inflate the priority of new local files."""
         return self._convert_bool(self._cfg_file.vals["InflatePriority"])
 
-    @property
+    @CachedProperty
     def account_for_size(self) -> bool:
         """Take file size into account when prioritizing files."""
         return self._convert_bool(self._cfg_file.vals["AccountForSize"])
@@ -288,15 +310,12 @@ class ProfileExcludeFile:
     excluded a given file.
 
     Attributes:
-        comment_regex: Regex that denotes a comment line.
         path: The path of the exclude pattern file.
         _matches: A dict of relative paths of files that match the globbing
             patterns for each input path.
         _all_matches: A dict of relative paths of files that match the globbing
             patterns and all files under them for each input path.
     """
-    comment_regex = re.compile(r"^\s*#")
-
     def __init__(self, path: str) -> None:
         self.path = path
         self._matches = {}
@@ -321,57 +340,179 @@ class ProfileExcludeFile:
                 # The patterns follow shell globbing rules as described in zielen(1).
                 """))
             if infile == "-":
-                for line in sys.stdin.read():
-                    outfile.write(line)
+                shutil.copyfileobj(sys.stdin, outfile)
             elif infile:
                 with open(infile) as infile:
-                    for line in infile:
-                        outfile.write(line)
+                    shutil.copyfileobj(infile, outfile)
 
     def _readlines(self) -> Generator[str, None, None]:
-        """Yield lines that are not comments.
+        """Yield lines that are not comments or blank.
+
+        This assumes that cases where the user may accidentally leave
+        leading/trailing whitespace are more common than cases where they may
+        actually need it.
 
         Yields:
-            Each line in the file that's not a comment.
+            Each line in the file that's not a comment with surrounding
+            whitespace and the trailing newline stripped.
         """
         with open(self.path) as file:
             for line in file:
-                if not self.comment_regex.search(line):
+                line = line.strip()
+                if line and not line.startswith("#"):
                     yield line
 
+    @staticmethod
+    def _translate(pattern: str) -> str:
+        """Convert a globbing pattern into a regular expression.
+
+        The regular expression matches relative paths in the same way that
+        glob.glob() would match them. Wildcards don't match hidden files unless
+        the pattern component starts with a dot, and a double asterisk matches
+        any number of directories that aren't hidden. Directories should also
+        be matched with a trailing slash, which patterns that only match
+        directories require.
+
+        Args:
+            pattern: The globbing pattern relative to the start path.
+
+        Returns:
+            A regular expression string.
+        """
+        # This matches the start of a file name that isn't hidden.
+        hidden_check = r"(?=[^./])"
+        any_name = r"[^./][^/]*"
+        regex = ""
+        dir_only = pattern.endswith("/")
+        components = []
+        for component in pattern.split("/"):
+            if not component or component == ".":
+                continue
+            # Consecutive double asterisks match the same paths as one.
+            if component == "**" and components and components[-1] == "**":
+                continue
+            components.append(component)
+
+        for i, component in enumerate(components):
+            last = i == len(components) - 1 and not dir_only
+            if component == "**":
+                if not last:
+                    regex += r"(?:{0}/)*".format(any_name)
+                else:
+                    # This matches the parent directory as well.
+                    regex += r"(?:{0}(?:/{0})*)?".format(any_name)
+                continue
+
+            if glob.has_magic(component) and not component.startswith("."):
+                regex += hidden_check
+
+            regex += ProfileExcludeFile._translate_component(component)
+
+            if not last:
+                regex += "/"
+
+        return regex
+
+    @staticmethod
+    def _translate_component(component: str) -> str:
+        """Convert one component of a globbing pattern into a regex.
+
+        The regular expression comes from fnmatch.translate(), with every
+        wildcard and character set changed so that it can't match a slash.
+
+        Args:
+            component: The part of the globbing pattern between two slashes.
+
+        Returns:
+            A regular expression string.
+        """
+        regex = fnmatch.translate(component)
+        # Strip the anchor and flags, whose form depends on the Python version.
+        if regex.startswith("(?s:"):
+            regex = regex[len("(?s:"):regex.rindex(")")]
+        else:
+            regex = regex[:regex.rindex(r"\Z")]
+
+        parts = []
+        i, length = 0, len(regex)
+        while i < length:
+            char = regex[i]
+            if char == "\\":
+                parts.append(regex[i:i + 2])
+                i += 2
+            elif char == ".":
+                parts.append(r"[^/]")
+                i += 1
+            elif char == "[":
+                # A closing bracket at the start of a set is a literal.
+                j = i + 1
+                if regex[j] == "^":
+                    j += 1
+                if regex[j] == "]":
+                    j += 1
+                while regex[j] != "]":
+                    j += 2 if regex[j] == "\\" else 1
+                parts.append(r"(?!/)" + regex[i:j + 1])
+                i = j + 1
+            else:
+                parts.append(char)
+                i += 1
+
+        return "".join(parts)
+
     def _glob(self, start_path: str) -> None:
         """Create a set of all file paths that match the globbing patterns.
 
+        All of the patterns are combined into a single regular expression so
+        that the directory tree only needs to be walked once. Unlike
+        glob.glob(), this doesn't descend into symlinks to directories.
+
         Args:
             start_path: The directory to search in for files that match the
                 patterns.
         """
-        self._matches[start_path] = set()
-        self._all_matches[start_path] = set()
+        matches = self._matches[start_path] = set()
+        all_matches = self._all_matches[start_path] = set()
 
+        patterns = []
         for line in self._readlines():
-            # This assumes that cases where the user may accidentally leave
-            # leading/trailing whitespace are more common than cases where they
-            # may actually need it. This also strips trailing newlines.
-            line = line.strip()
-            if not line:
-                continue
             if line.startswith("/"):
-                glob_str = os.path.join(start_path, line.lstrip("/"))
+                pattern = line.lstrip("/")
             else:
                 # Glob patterns without a leading slash search the whole tree.
-                glob_str = os.path.join(start_path, "**", line)
-
-            for match_path in glob.glob(glob_str, recursive=True):
-                rel_match_path = os.path.relpath(match_path, start_path)
-                self._matches[start_path].add(rel_match_path)
-                self._all_matches[start_path].add(rel_match_path)
-                try:
-                    for entry in scan_tree(match_path):
-                        self._all_matches[start_path].add(
-                            os.path.relpath(entry.path, start_path))
-                except NotADirectoryError:
-                    pass
+                pattern = "**/" + line
+
+            regex = self._translate(pattern)
+            try:
+                re.compile(regex)
+            except re.error:
+                # A pattern that can't be compiled never matches, so it
+                # shouldn't stop the other patterns from being used.
+                continue
+            patterns.append(regex)
+
+        if not patterns or not os.path.isdir(start_path):
+            return
+
+        regex = re.compile("|".join(patterns))
+        prefix_len = len(os.path.join(start_path, ""))
+
+        # Patterns like "**" match the start directory itself.
+        match_all = bool(regex.fullmatch(""))
+        if match_all:
+            matches.add(os.curdir)
+            all_matches.add(os.curdir)
+
+        # Files are always yielded after their parent directory, so the files
+        # under a matching directory can be found by checking their parent.
+        for entry in scan_tree(start_path):
+            rel_path = entry.path[prefix_len:]
+            if (regex.fullmatch(rel_path) or entry.is_dir()
+                    and regex.fullmatch(rel_path + "/")):
+                matches.add(rel_path)
+                all_matches.add(rel_path)
+            elif match_all or os.path.dirname(rel_path) in all_matches:
+                all_matches.add(rel_path)
 
     def matches(self, start_path: str) -> Set[str]:
         """Get the paths of files that match globbing patterns.
@@ -425,12 +566,11 @@ class ProfileInfoFile(JSONFile):
             add_remote: The '--add-remote' command-line option is set.
         """
         unique_id = uuid.uuid4().hex
-        version = pkg_resources.get_distribution("zielen").version
         self.vals.update({
             "Status": "partial",
             "LastSync": None,
             "LastAdjust": None,
-            "Version": version,
+            "Version": get_version(),
             "ID": unique_id,
             "InitOptions": {}
             })
@@ -442,10 +582,23 @@ class ProfileDBFile(SyncDBFile):
     """Manipulate a profile database for keeping track of files.
 
     Attributes:
+        _CONNECTION_PRAGMAS: A script of pragmas that must be set every time a
+            connection to the database is opened. Because the database is in
+            WAL mode, it is safe to only sync at checkpoints. The page cache
+            is set to 20MB and the memory map to 256MB.
         path: The path of the profile database file.
         _conn: The sqlite connection object for the database.
         _cur: The sqlite cursor object for the connection.
     """
+    _CONNECTION_PRAGMAS = """\
+        PRAGMA foreign_keys = ON;
+        PRAGMA synchronous = NORMAL;
+        PRAGMA temp_store = MEMORY;
+        PRAGMA cache_size = -20000;
+        PRAGMA mmap_size = 268435456;
+        PRAGMA wal_autocheckpoint = 1000;
+        """
+
     def create(self) -> None:
         """Create a new empty database.
 
@@ -455,18 +608,15 @@ class ProfileDBFile(SyncDBFile):
         if os.path.isfile(self.path):
             raise FileExistsError("the database file already exists")
 
-        self._conn = sqlite3.connect(
-            self.path,
-            detect_types=sqlite3.PARSE_DECLTYPES,
-            isolation_level="DEFERRED")
-        self._conn.create_function("gen_salt", 0, lambda: secure_string(8))
-
-        self._cur = self._conn.cursor()
-        self._cur.arraysize = 20
+        # A connection may still be open to a database file that has since
+        # been deleted.
+        self._reconnect()
 
         with self._transact():
+            # The page size must be set before any tables are created and
+            # before switching to WAL mode.
             self._cur.executescript("""\
-                PRAGMA foreign_keys = ON;
+                PRAGMA page_size = 4096;
                 PRAGMA journal_mode = WAL;
 
                 CREATE TABLE nodes (
@@ -489,6 +639,9 @@ class ProfileDBFile(SyncDBFile):
                         REFERENCES nodes(id) ON DELETE CASCADE
                 ) WITHOUT ROWID;
 
+                CREATE INDEX closure_descendant
+                ON closure (descendant, depth);
+
                 CREATE TABLE collisions (
                     path        TEXT    NOT NULL,
                     salt        TEXT    NOT NULL,
@@ -496,62 +649,87 @@ class ProfileDBFile(SyncDBFile):
                 );
                 """)
 
-    def _update_priority(self, paths: Iterable[str]) -> None:
-        """Update the priority values of directories.
+    def _update_directories(
+            self, paths: Iterable[str], priority=True, local=True) -> None:
+        """Update the priority and local values of directories.
 
-        Directories are checked in leaf-to-trunk order. The priority value
-        of a directory is set to the sum of the priority values of all its
-        immediate children. For every directory that's checked, all of its
+        The priority value of a directory is set to the sum of the priority
+        values of all its immediate children. A directory is considered to be
+        not in the local directory if any of its immediate children are not in
+        the local directory. For every directory that's checked, all of its
         ancestors up the tree are also checked.
 
-        Args:
-            paths: The relative paths of the directories to update the priority
-                values of.
-        """
-        nodes_values = []
-        for path in get_path_ancestry(paths):
-            path_id = self._get_path_id(path)
-            nodes_values.append({"path_id": path_id})
-
-        self._cur.executemany("""\
-            UPDATE nodes
-            SET priority = (
-                SELECT COALESCE(SUM(n.priority), 0)
-                FROM nodes AS n
-                JOIN closure AS c
-                ON (n.id = c.descendant)
-                WHERE c.ancestor = :path_id
-                AND c.depth = 1)
-            WHERE id = :path_id;
-            """, nodes_values)
-
-    def _update_local(self, paths: Iterable[str]) -> None:
-        """Update whether directories have been kept in the local directory.
-
-        Directories are checked in leaf-to-trunk order. A directory is
-        considered to be not in the local directory if any of its immediate
-        children are not in the local directory. For every directory that's
-        checked, all of its ancestors up the tree are also checked.
+        Rather than updating directories in leaf-to-trunk order, the values of
+        each directory are computed from its descendants that aren't being
+        updated but whose parent is. The priority is the sum of their
+        priorities, and the directory is local if they're all local and none
+        of the directories being updated below it are empty. This gives the
+        same result in a single statement, and both values are updated in the
+        same statement so that the ancestors only need to be staged once.
 
         Args:
             paths: The relative paths of the directories to update.
+            priority: Update the priority values of the directories.
+            local: Update the local values of the directories.
         """
-        nodes_values = []
-        for path in get_path_ancestry(paths):
-            path_id = self._get_path_id(path)
-            nodes_values.append({"path_id": path_id})
+        # The parents of the descendants are checked against the staged
+        # ancestors with EXISTS rather than IN. Otherwise, sqlite probes the
+        # closure index once for every staged ancestor for every descendant,
+        # which is quadratic when many directories are updated at once.
+        set_clauses = []
+        if priority:
+            set_clauses.append("""\
+                priority = (
+                    SELECT COALESCE(SUM(n.priority), 0)
+                    FROM nodes AS n
+                    JOIN closure AS c
+                    ON (n.id = c.descendant)
+                    JOIN closure AS p
+                    ON (p.descendant = c.descendant AND p.depth = 1)
+                    WHERE c.ancestor = nodes.id
+                    AND c.depth > 0
+                    AND c.descendant NOT IN ancestors
+                    AND EXISTS (
+                        SELECT 1
+                        FROM ancestors AS a
+                        WHERE a.id = p.ancestor))""")
+        if local:
+            set_clauses.append("""\
+                local = (
+                    SELECT COALESCE(MIN(n.local), 0)
+                    FROM nodes AS n
+                    JOIN closure AS c
+                    ON (n.id = c.descendant)
+                    JOIN closure AS p
+                    ON (p.descendant = c.descendant AND p.depth = 1)
+                    WHERE c.ancestor = nodes.id
+                    AND c.depth > 0
+                    AND c.descendant NOT IN ancestors
+                    AND EXISTS (
+                        SELECT 1
+                        FROM ancestors AS a
+                        WHERE a.id = p.ancestor))
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM closure AS c
+                    WHERE c.ancestor = nodes.id
+                    AND c.descendant IN ancestors
+                    AND NOT EXISTS (
+                        SELECT 1
+                        FROM closure AS e
+                        WHERE e.ancestor = c.descendant
+                        AND e.depth = 1))""")
+        if not set_clauses:
+            return
 
-        self._cur.executemany("""\
+        # Each of these only reads the values of rows that aren't being
+        # updated, so they can safely be set in the same statement.
+        self._stage_ancestors(paths)
+        self._cur.execute("""\
             UPDATE nodes
-            SET local = (
-                SELECT COALESCE(MIN(n.local), 0)
-                FROM nodes AS n
-                JOIN closure AS c
-                ON (n.id = c.descendant)
-                WHERE c.ancestor = :path_id
-                AND c.depth = 1)
-            WHERE id = :path_id;
-            """, nodes_values)
+            SET {0}
+            WHERE id IN ancestors;
+            """.format(",\n".join(set_clauses)))
 
     def add_paths(self, files: Iterable[str], dirs: Iterable[str],
                   priority=0, local=True) -> None:
@@ -568,67 +746,24 @@ class ProfileDBFile(SyncDBFile):
             local: The paths are the paths of files that have been kept in the
                 local directory.
         """
-        # Sort paths by depth. A file can't be added to the database until its
-        # parent directory has been added.
-        files = set(files)
-        dirs = set(dirs)
-        paths = list(files | dirs)
-        paths.sort(key=lambda x: x.count(os.sep))
-
-        while True:
-            parents = set()
-            insert_nodes_vals = []
-            insert_closure_vals = []
-            rm_vals = []
-            for path in paths:
-                path_id = self._get_path_id(path)
-                parent = os.path.dirname(path)
-                if parent:
-                    parents.add(parent)
-                    parent_id = self._get_path_id(parent)
-                else:
-                    parent_id = path_id
-
-                rm_vals.append({
-                    "path_id": path_id})
-                insert_nodes_vals.append({
-                    "path": path,
-                    "path_id": path_id,
-                    "directory": bool(path in dirs),
-                    "priority": priority,
-                    "local": local})
-                insert_closure_vals.append({
-                    "path_id": path_id,
-                    "parent_id": parent_id})
-
-            # If there are any hash collisions with paths already in the
-            # database, generate salt and continue the loop to regenerate
-            # the path IDs.
-            self._cur.executemany("""\
-                INSERT INTO collisions (path, salt)
-                SELECT :path, gen_salt()
-                FROM nodes
-                WHERE id = :path_id
-                AND path != :path;
-                """, insert_nodes_vals)
-            if self._cur.rowcount <= 0:
-                break
+        depths = self._stage_paths(files, dirs)
 
         # Insert new values into both tables.
-        self._cur.executemany("""\
+        self._cur.execute("""\
             INSERT INTO nodes (id, path, directory, priority, local)
-            VALUES (:path_id, :path, :directory, :priority, :local);
-            """, insert_nodes_vals)
-        self._cur.executemany("""\
-            INSERT INTO closure (ancestor, descendant, depth)
-            SELECT ancestor, :path_id, c.depth + 1
-            FROM closure AS c
-            WHERE descendant = :parent_id
-            UNION ALL SELECT :path_id, :path_id, 0;
-            """, insert_closure_vals)
+            SELECT id, path, directory, :priority, :local
+            FROM incoming;
+            """, {"priority": priority, "local": local})
+        self._insert_closure(depths)
+
+        self._cur.execute("""\
+            SELECT DISTINCT parent
+            FROM incoming
+            WHERE parent != '';
+            """)
+        parents = [parent for parent, in self._cur.fetchall()]
         self._mark_directory(parents)
-        self._update_priority(parents)
-        self._update_local(parents)
+        self._update_directories(parents)
 
     def add_inflated(self, files: Iterable[str], dirs: Iterable[str]) -> None:
         """Add new file paths to the database with an inflated priority.
@@ -658,41 +793,39 @@ class ProfileDBFile(SyncDBFile):
             local: The paths are the paths of files that have been kept in the
                 local directory. Use None to leave the value unchanged.
         """
-        update_vals = []
-        for path in paths:
-            path_id = self._get_path_id(path)
-
-            update_vals.append({
-                "path_id": path_id,
-                "directory": directory,
-                "priority": priority,
-                "local": local})
-
-        if directory is not None:
-            self._cur.executemany("""\
-                UPDATE nodes
-                SET directory = :directory
-                WHERE id = :path_id;
-                """, update_vals)
-
-        if priority is not None:
-            self._cur.executemany("""\
-                UPDATE nodes
-                SET priority = :priority
-                WHERE id = :path_id;
-                """, update_vals)
-
-        if local is not None:
-            self._cur.executemany("""\
+        paths = list(paths)
+
+        # Only the columns that are being changed are set, so that all of them
+        # can be updated in a single statement. The paths are passed in as a
+        # JSON array so that the statement only needs to be executed once.
+        set_clause = ", ".join(
+            "{0} = :{0}".format(column) for column, value in [
+                ("directory", directory),
+                ("priority", priority),
+                ("local", local)]
+            if value is not None)
+
+        if set_clause:
+            self._cur.execute("""\
                 UPDATE nodes
-                SET local = :local
-                WHERE id = :path_id;
-                """, update_vals)
+                SET {0}
+                WHERE id IN (
+                    SELECT path_id(j.value, (
+                        SELECT salt
+                        FROM collisions
+                        WHERE path = j.value))
+                    FROM json_each(:paths) AS j);
+                """.format(set_clause), {
+                    "paths": json.dumps(paths),
+                    "directory": directory,
+                    "priority": priority,
+                    "local": local})
 
-        parents = {
-            os.path.dirname(path) for path in paths if os.path.dirname(path)}
-        self._update_priority(parents)
-        self._update_local(parents)
+        # The values of the parent directories only need to be recalculated
+        # if the values they're calculated from have changed.
+        parents = {parent for parent in map(os.path.dirname, paths) if parent}
+        self._update_directories(
+            parents, priority=priority is not None, local=local is not None)
 
     def rm_paths(self, paths: Iterable[str]) -> None:
         """Remove file paths from the database.
@@ -703,31 +836,30 @@ class ProfileDBFile(SyncDBFile):
         Args:
             paths: The file paths to remove.
         """
-        # A generator expression can't be used here because recursive use of
-        # cursors is not allowed.
-        rm_vals = [{
-            "path_id": self._get_path_id(path)}
-            for path in paths]
-        parents = {
-            os.path.dirname(path) for path in paths if os.path.dirname(path)}
-
-        self._cur.executemany("""\
+        paths = list(paths)
+        parents = {parent for parent in map(os.path.dirname, paths) if parent}
+
+        # The paths are passed in as a JSON array so that the statement only
+        # needs to be executed once.
+        self._cur.execute("""\
             DELETE FROM nodes
             WHERE id IN (
-                SELECT n.id
-                FROM nodes AS n
-                JOIN closure AS c
-                ON (n.id = c.descendant)
-                WHERE c.ancestor = :path_id);
-            """, rm_vals)
+                SELECT c.descendant
+                FROM closure AS c
+                WHERE c.ancestor IN (
+                    SELECT path_id(j.value, (
+                        SELECT salt
+                        FROM collisions
+                        WHERE path = j.value))
+                    FROM json_each(:paths) AS j));
+            """, {"paths": json.dumps(paths)})
         self._cur.execute("""
             DELETE FROM collisions
             WHERE path NOT IN (
                 SELECT path
                 FROM nodes);
             """)
-        self._update_priority(parents)
-        self._update_local(parents)
+        self._update_directories(parents)
 
     def get_path_info(self, path: str) -> PathData:
         """Get data associated with a file path.
@@ -740,20 +872,59 @@ class ProfileDBFile(SyncDBFile):
             a directory, the file priority and a bool representing whether
             the file has been kept in the local directory.
         """
-        # Clear the query result set.
-        self._cur.fetchall()
-
-        path_id = self._get_path_id(path)
-        self._cur.execute("""\
+        # A separate cursor is used so that this doesn't discard the result
+        # set of the shared cursor. The path ID is computed in the same query.
+        cursor = self._conn.execute("""\
             SELECT directory, priority, local
             FROM nodes
-            WHERE id = :path_id;
-            """, {"path_id": path_id})
-
-        result = self._cur.fetchone()
+            WHERE id = path_id(:path, (
+                SELECT salt
+                FROM collisions
+                WHERE path = :path));
+            """, {"path": path})
+
+        result = cursor.fetchone()
+        cursor.close()
         if result:
             return PathData(*result)
 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _get_paths_query(root: bool, directory: bool, local: bool) -> str:
+        """Build a query for get_paths() with only the filters that are used.
+
+        Leaving out unused filters lets the query planner look up descendants
+        using the primary key of the closure table, and the closure table
+        doesn't need to be joined at all if there is no root.
+
+        Args:
+            root: Restrict results to paths under the directory ':start_id'.
+            directory: Restrict results based on the value of ':directory'.
+            local: Restrict results based on the value of ':local'.
+
+        Returns:
+            The SQL query string.
+        """
+        query = """\
+            SELECT n.path, n.directory, n.priority, n.local
+            FROM nodes AS n
+            """
+        conditions = []
+        if root:
+            query += """\
+            JOIN closure AS c
+            ON (n.id = c.descendant)
+            """
+            conditions.append("c.ancestor = :start_id")
+        if directory:
+            conditions.append("n.directory = :directory")
+        if local:
+            conditions.append("n.local = :local")
+        if conditions:
+            query += "WHERE " + " AND ".join(conditions)
+
+        return query + ";"
+
     def get_paths(
             self, root=None, directory=None, local=None
             ) -> Dict[str, PathData]:
@@ -776,23 +947,18 @@ class ProfileDBFile(SyncDBFile):
             the file has been kept in the local directory.
         """
         start_id = self._get_path_id(root) if root else None
-        self._cur.execute("""\
-            SELECT n.path, n.directory, n.priority, n.local
-            FROM nodes AS n
-            JOIN closure AS c
-            ON (n.id = c.descendant)
-            WHERE (:start_id IS NULL OR c.ancestor = :start_id)
-            AND (:directory IS NULL OR n.directory = :directory)
-            AND (:local IS NULL OR n.local = :local);
-            """, {
-                "start_id": start_id, "directory": directory, "local": local})
-
-        # As long as self._cur.arraysize is greater than 1, fetchmany() should
-        # be more efficient than fetchall().
+        query = self._get_paths_query(
+            start_id is not None, directory is not None, local is not None)
+        self._cur.execute(query, {
+            "start_id": start_id, "directory": directory, "local": local})
+
+        # The whole result set is needed, so build it in one fetchall() call
+        # instead of looping over fetchmany() batches. PathData._make() builds
+        # each named tuple straight from the rest of the row, which is faster
+        # than unpacking the row and passing its fields as arguments.
+        make_data = PathData._make
         return {
-            path: PathData(directory, priority, local)
-            for array in iter(self._cur.fetchmany, [])
-            for path, directory, priority, local in array}
+            row[0]: make_data(row[1:]) for row in self._cur.fetchall()}
 
     def increment(self, paths: Iterable[str],
                   increment: Union[int, float]) -> None:
@@ -802,21 +968,22 @@ class ProfileDBFile(SyncDBFile):
             paths: The paths to increment the priority of.
             increment: The value to increment the paths by.
         """
-        # A generator expression can't be used here because recursive use of
-        # cursors is not allowed.
-        increment_vals = [{
-            "path_id": self._get_path_id(path),
-            "increment": increment}
-            for path in paths]
-        parents = {
-            os.path.dirname(path) for path in paths if os.path.dirname(path)}
-
-        self._cur.executemany("""\
+        paths = list(paths)
+        parents = {parent for parent in map(os.path.dirname, paths) if parent}
+
+        # The paths are passed in as a JSON array so that the statement only
+        # needs to be executed once.
+        self._cur.execute("""\
             UPDATE nodes
             SET priority = priority + :increment
-            WHERE id = :path_id;
-            """, increment_vals)
-        self._update_priority(parents)
+            WHERE id IN (
+                SELECT path_id(j.value, (
+                    SELECT salt
+                    FROM collisions
+                    WHERE path = j.value))
+                FROM json_each(:paths) AS j);
+            """, {"paths": json.dumps(paths), "increment": increment})
+        self._update_directories(parents, local=False)
 
     def adjust_all(self, adjustment: Union[int, float]) -> None:
         """Multiply the priorities of all file paths by a constant.
@@ -843,16 +1010,24 @@ class ProfileConfigFile(ConfigFile):
     Attributes:
         TRUE_VALS: A list of strings that are recognized as boolean true.
         FALSE_VALS: A list of strings that are recognized as boolean false.
+        SIZE_REGEX: A regex object that represents an amount of storage.
         _required_keys: A list of config keys that must be included in the
-            config file.
+            config file in the order that the user is prompted for them.
         _optional_keys: A list of config keys that may be commented out or
             omitted.
-        _all_keys: A list of all keys that are recognized in the config file.
-        _bool_keys: A subset of config keys that must have boolean values.
+        _all_keys: A set of all keys that are recognized in the config file.
+        _bool_keys: A set of config keys that must have boolean values.
+        _path_keys: A set of config keys that must have absolute paths as
+            values.
+        _bool_vals: A set of all strings that are recognized as booleans.
+        _value_formats: A dictionary of config keys and tuples containing a
+            function that their values must satisfy and the error message to
+            use if they don't.
         _defaults: A dictionary of default string values for optional config
             keys.
         _prompt_messages: The messages to use when prompting the user for config
-            values.
+            values. These are wrapped to 79 columns once when the class is
+            created.
         _autocomplete_funcs: The functions used to enable autocompletion at the
             interactive prompt for each config key.
         path: The path of the configuration file.
@@ -860,9 +1035,13 @@ class ProfileConfigFile(ConfigFile):
         add_remote: Switch the requirements of 'LocalDir' and 'RemoteDir'.
         raw_vals: A dictionary of raw config value strings.
         vals: A dict property of parsed config values.
+        _resolved_vals: A dictionary of the raw config values merged over the
+            defaults. This is rebuilt when the raw values are read or
+            replaced, so it may be None.
     """
     TRUE_VALS = ["yes", "true"]
     FALSE_VALS = ["no", "false"]
+    SIZE_REGEX = re.compile(r"([0-9]+)\s*([KMG])(B|iB)?", re.IGNORECASE)
     _required_keys = [
         "LocalDir", "RemoteDir", "StorageLimit"
         ]
@@ -870,10 +1049,24 @@ class ProfileConfigFile(ConfigFile):
         "SyncInterval", "PriorityHalfLife", "UseTrash", "TrashCleanupPeriod",
         "InflatePriority", "AccountForSize"
         ]
-    _all_keys = _required_keys + _optional_keys
-    _bool_keys = [
+    _all_keys = frozenset(_required_keys + _optional_keys)
+    _bool_keys = frozenset([
         "UseTrash", "InflatePriority", "AccountForSize"
-        ]
+        ])
+    _bool_vals = frozenset(TRUE_VALS + FALSE_VALS)
+    _path_keys = frozenset([
+        "LocalDir", "RemoteDir"
+        ])
+    _value_formats = dict.fromkeys(
+        _path_keys, (_is_abs_path, "must be an absolute path"))
+    _value_formats.update({
+        "StorageLimit": (
+            SIZE_REGEX.fullmatch,
+            "must be an integer followed by a unit (e.g. 10GB)"),
+        "SyncInterval": (str.isdecimal, "must be an integer"),
+        "PriorityHalfLife": (str.isdecimal, "must be an integer"),
+        "TrashCleanupPeriod": (_is_int, "must be an integer")
+        })
     _defaults = {
         "SyncInterval": "20",
         "PriorityHalfLife": "120",
@@ -883,12 +1076,14 @@ class ProfileConfigFile(ConfigFile):
         "AccountForSize": "yes"
         }
     _prompt_messages = {
-        "LocalDir":     "Enter the path of the local sync directory.",
-        "RemoteDir":    "Enter the path of the remote sync directory.",
-        "StorageLimit": "Enter the amount of data to keep in the local "
-                        "directory. This accepts KB, MB, GB, KiB, MiB and "
-                        "GiB as units. "
-        }
+        key: "\n".join(textwrap.wrap(message, width=79))
+        for key, message in {
+            "LocalDir":     "Enter the path of the local sync directory.",
+            "RemoteDir":    "Enter the path of the remote sync directory.",
+            "StorageLimit": "Enter the amount of data to keep in the local "
+                            "directory. This accepts KB, MB, GB, KiB, MiB and "
+                            "GiB as units. "
+            }.items()}
 
     _autocomplete_funcs = {
         "LocalDir": set_path_autocomplete,
@@ -896,6 +1091,21 @@ class ProfileConfigFile(ConfigFile):
         "StorageLimit": set_no_autocomplete
         }
 
+    @property
+    def raw_vals(self) -> Dict[str, str]:
+        """A dictionary of raw config value strings."""
+        return self._raw_vals
+
+    @raw_vals.setter
+    def raw_vals(self, value: Dict[str, str]) -> None:
+        self._raw_vals = value
+        self._resolved_vals = None
+
+    def read(self) -> None:
+        """Extend parent method to discard the merged config values."""
+        super().read()
+        self._resolved_vals = None
+
     def check_value(self, key: str, value: str) -> Optional[str]:
         """Check the syntax of a config option and return an error message.
 
@@ -912,27 +1122,14 @@ class ProfileConfigFile(ConfigFile):
 
         # Check boolean values.
         if key in self._bool_keys and value:
-            if value.lower() not in (self.TRUE_VALS + self.FALSE_VALS):
+            if value.lower() not in self._bool_vals:
                 return "must have a boolean value"
 
-        if key == "LocalDir":
-            if not re.search("^~?/", value):
-                return "must be an absolute path"
-        elif key == "RemoteDir":
-            if not re.search("^~?/", value):
-                return "must be an absolute path"
-        elif key == "StorageLimit":
-            if not re.search(r"^[0-9]+\s*[KMG](B|iB)?$", value, re.IGNORECASE):
-                return "must be an integer followed by a unit (e.g. 10GB)"
-        elif key == "SyncInterval":
-            if not re.search("^[0-9]+$", value):
-                return "must be an integer"
-        elif key == "PriorityHalfLife":
-            if not re.search("^[0-9]+$", value):
-                return "must be an integer"
-        elif key == "TrashCleanupPeriod":
-            if not re.search(r"^-?[0-9]+$", value):
-                return "must be an integer"
+        value_format = self._value_formats.get(key)
+        if value_format:
+            is_valid, error_message = value_format
+            if not is_valid(value):
+                return error_message
 
     def check_all(self, check_empty=True, context="config file") -> None:
         """Check that file is valid and syntactically correct.
@@ -947,20 +1144,27 @@ class ProfileConfigFile(ConfigFile):
         """
         parse_errors = []
 
-        # Check that all key names are valid.
-        missing_keys = set(self._required_keys) - self.raw_vals.keys()
-        unrecognized_keys = self.raw_vals.keys() - set(self._all_keys)
-        for key in missing_keys:
-            parse_errors.append(
-                "{0}: missing required option '{1}'".format(context, key))
-        for key in unrecognized_keys:
-            parse_errors.append(
-                "{0}: unrecognized option '{1}'".format(context, key))
-
-        # Check values for valid syntax.
-        for key, value in self.raw_vals.items():
-            if check_empty or not check_empty and value:
-                err_msg = self.check_value(key, value)
+        raw_vals = self.raw_vals
+        for key in self._required_keys:
+            if key not in raw_vals:
+                parse_errors.append(
+                    "{0}: missing required option '{1}'".format(context, key))
+
+        # Check that all key names are valid and that their values have valid
+        # syntax in a single pass. Bind the method to a local name since it's
+        # looked up once for every key.
+        check_value = self.check_value
+        all_keys = self._all_keys
+        for key, value in raw_vals.items():
+            if key not in all_keys:
+                parse_errors.append(
+                    "{0}: unrecognized option '{1}'".format(context, key))
+                continue
+
+            # Validate non-empty values, or every value when check_empty is
+            # set.
+            if check_empty or value:
+                err_msg = check_value(key, value)
                 if err_msg:
                     parse_errors.append(
                         "{0}: '{1}' {2}".format(context, key, err_msg))
@@ -971,36 +1175,60 @@ class ProfileConfigFile(ConfigFile):
     @DictProperty
     def vals(self, key: str) -> Any:
         """Get defaults if corresponding raw values are unset."""
-        if key in self.raw_vals:
-            return self.raw_vals[key]
-        elif key in self._defaults:
-            return self._defaults[key]
+        # Merge the raw values over the defaults once so that each lookup
+        # only needs to check one dict.
+        resolved_vals = self._resolved_vals
+        if resolved_vals is None:
+            resolved_vals = self._resolved_vals = self._defaults.copy()
+            resolved_vals.update(self.raw_vals)
+        return resolved_vals.get(key)
 
     @vals.setter
     def vals(self, key: str, value: str) -> None:
         """Set individual config values."""
         self.raw_vals[key] = value
+        if self._resolved_vals is not None:
+            self._resolved_vals[key] = value
 
     def prompt(self) -> None:
         """Prompt the user interactively for unset required values."""
-        prompt_keys = [
-            key for key in self._required_keys
-            if key not in self.raw_vals.keys() or not self.raw_vals[key]]
-        if not prompt_keys:
-            return
+        raw_vals = self.raw_vals
+        autocomplete_funcs = self._autocomplete_funcs
+        prompt_messages = self._prompt_messages
+        check_value = self.check_value
+        strip = str.strip
+        stderr = sys.stderr
+        current_autocomplete = None
+        for key in self._required_keys:
+            if raw_vals.get(key):
+                continue
+
+            # Consecutive keys often use the same kind of autocompletion, so
+            # only reconfigure readline when it changes.
+            autocomplete_func = autocomplete_funcs[key]
+            if autocomplete_func is not current_autocomplete:
+                autocomplete_func()
+                current_autocomplete = autocomplete_func
+
+            message = prompt_messages[key]
+            try:
+                while True:
+                    print(message)
+                    user_input = strip(input("> "))
+                    print()
+                    error_message = check_value(key, user_input)
+                    if error_message:
+                        print(
+                            "Error: this value " + error_message, file=stderr)
+                    else:
+                        break
+                    print()
+
+                    # Pre-fill the next prompt with the rejected value so that
+                    # the user can edit it instead of retyping it.
+                    readline.set_startup_hook(
+                        lambda: readline.insert_text(user_input))
+            finally:
+                readline.set_startup_hook()
 
-        for key in prompt_keys:
-            self._autocomplete_funcs[key]()
-            while True:
-                print("\n".join(
-                    textwrap.wrap(self._prompt_messages[key], width=79)))
-                user_input = input("> ").strip()
-                print()
-                error_message = self.check_value(key, user_input)
-                if error_message:
-                    print(
-                        "Error: this value " + error_message, file=sys.stderr)
-                else:
-                    break
-                print()
             self.vals[key] = user_input
@@ -18,17 +18,19 @@ You should have received a copy of the GNU General Public License
 along with zielen.  If not, see <http://www.gnu.org/licenses/>.
 """
 import os
+import json
+import stat
+import functools
 import shutil
-import sqlite3
 import time
 from typing import (
     Tuple, Iterable, List, Dict, NamedTuple, Generator, Union, Set)
 
 from zielen.exceptions import RemoteError
 from zielen.containerbase import SyncDBFile
-from zielen.fstools import scan_tree
+from zielen.fstools import stat_tree
 from zielen.profile import ProfileExcludeFile
-from zielen.utils import FactoryDict, secure_string
+from zielen.utils import FactoryDict
 
 PathData = NamedTuple("PathData", [("directory", bool), ("lastsync", float)])
 
@@ -38,11 +40,21 @@ class SyncDir:
 
     Attributes:
         path: The directory path without a trailing slash.
+        _sub_entries: A dict with the relative paths of files in the directory
+            as keys and their os.stat_result objects as values. This is empty
+            until the directory is scanned.
+        _scan_results: A dict with tuples of arguments to scan_paths() as keys
+            and the dicts it returned as values. This is cleared whenever the
+            directory is re-scanned.
+        _skip_paths: The absolute paths of files to leave out when scanning
+            the directory. Directories with these paths are not descended
+            into.
     """
-
     def __init__(self, path: str) -> None:
         self.path = path.rstrip(os.sep)
-        self._sub_entries = []
+        self._sub_entries = {}
+        self._scan_results = {}
+        self._skip_paths = frozenset()
 
     def scan_paths(
             self, rel=True, files=True, symlinks=True, dirs=True, exclude=None,
@@ -51,7 +63,8 @@ class SyncDir:
 
         Symlinks are not followed. Directory paths and their os.stat_result
         objects are cached so that the filesystem is not scanned each time the
-        method is called.
+        method is called. The output for each combination of arguments is also
+        cached, so the returned dict is shared and must not be modified.
 
         Args:
             rel: Return relative file paths.
@@ -68,41 +81,57 @@ class SyncDir:
         Returns:
             A dict with file paths as keys and stat objects as values.
         """
-        exclude = set() if exclude is None else set(exclude)
+        exclude = frozenset() if exclude is None else frozenset(exclude)
+
+        if not memoize or not self._sub_entries:
+            # Computing the relative path is expensive to do each time. Every
+            # entry's path starts with the path of the directory, so the
+            # relative path can be sliced off instead of using relpath().
+            prefix_len = len(self.path) + len(os.sep)
+            self._sub_entries = {}
+            self._scan_results.clear()
+            # Each file is stat'ed exactly once, while it's being scanned.
+            # The file type is read from the stat object afterwards instead of
+            # going back to the os.DirEntry.
+            for entry, entry_stat in stat_tree(self.path, self._skip_paths):
+                self._sub_entries[entry.path[prefix_len:]] = entry_stat
+
+        # The same paths are often requested several times per sync, so don't
+        # filter the entries again if nothing has been re-scanned since.
+        args = (rel, files, symlinks, dirs, exclude, lookup)
+        if args in self._scan_results:
+            return self._scan_results[args]
+
         if lookup:
             def lookup_stat(path: str) -> os.stat_result:
-                full_path = os.path.join(self.path, path)
-                for entry, rel_path in self._sub_entries:
-                    if entry.path == full_path:
-                        return entry.stat()
-                return os.stat(full_path, follow_symlinks=False)
+                try:
+                    return self._sub_entries[path]
+                except KeyError:
+                    return os.stat(
+                        os.path.join(self.path, path), follow_symlinks=False)
 
             output = FactoryDict(lookup_stat)
         else:
             output = {}
 
-        if not memoize or not self._sub_entries:
-            self._sub_entries = []
-            for entry in scan_tree(self.path):
-                # Computing the relative path is expensive to do each time.
-                rel_path = os.path.relpath(entry.path, self.path)
-                self._sub_entries.append((entry, rel_path))
-
-        for entry, rel_path in self._sub_entries:
-            if entry.is_file(follow_symlinks=False) and not files:
+        prefix = self.path + os.sep
+        for rel_path, entry_stat in self._sub_entries.items():
+            mode = entry_stat.st_mode
+            if stat.S_ISREG(mode) and not files:
                 continue
-            elif entry.is_dir(follow_symlinks=False) and not dirs:
+            elif stat.S_ISDIR(mode) and not dirs:
                 continue
-            elif entry.is_symlink() and not symlinks:
+            elif stat.S_ISLNK(mode) and not symlinks:
                 continue
             elif rel_path in exclude:
                 continue
             else:
                 if rel:
-                    output[rel_path] = entry.stat(follow_symlinks=False)
+                    output[rel_path] = entry_stat
                 else:
-                    output[entry.path] = entry.stat(follow_symlinks=False)
+                    output[prefix + rel_path] = entry_stat
 
+        self._scan_results[args] = output
         return output
 
     def disk_usage(self, memoize=True) -> int:
@@ -114,12 +143,12 @@ class SyncDir:
         Returns:
             The total disk usage of the directory in bytes.
         """
+        # The output of scan_paths() is cached, so this usually doesn't build a
+        # new dict. Going through it instead of the cached entries lets
+        # subclasses leave out files.
         paths = self.scan_paths(memoize=memoize)
-
-        total_size = 0
-        for path, stat in paths.items():
-            total_size += stat.st_blocks * 512
-        return total_size
+        return sum(
+            path_stat.st_blocks for path_stat in paths.values()) * 512
 
     def space_avail(self) -> int:
         """Get the available space in the filesystem the directory is in.
@@ -158,6 +187,9 @@ class RemoteSyncDir(SyncDir):
         self._exclude_dir = os.path.join(self.util_dir, "exclude")
         self._db_file = RemoteDBFile(os.path.join(self.util_dir, "remote.db"))
 
+        # The util directory isn't part of the synced files, so don't scan it.
+        self._skip_paths = frozenset([self.util_dir])
+
         # Import methods from content classes.
         self.add_paths = self._db_file.add_paths
         self.update_paths = self._db_file.update_paths
@@ -225,29 +257,16 @@ class RemoteSyncDir(SyncDir):
         for entry in os.scandir(self._exclude_dir):
             pattern_files.append(ProfileExcludeFile(entry.path))
 
-        rm_files = set()
-        for path in paths:
-            for pattern_file in pattern_files:
-                if path not in pattern_file.all_matches(start_path):
-                    break
-            else:
-                rm_files.add(path)
+        # Each client's matches are only computed once, so intersect them as
+        # sets instead of checking each path against each client.
+        rm_files = set(paths)
+        for pattern_file in pattern_files:
+            if not rm_files:
+                break
+            rm_files &= pattern_file.all_matches(start_path)
 
         return rm_files
 
-    def scan_paths(
-            self, rel=True, files=True, symlinks=True, dirs=True, exclude=None,
-            memoize=True, lookup=True):
-        """Extend parent method to automatically exclude the util directory."""
-        rel_util_path = os.path.relpath(self.util_dir, self.path)
-        output = super().scan_paths(
-            rel=rel, files=files, symlinks=symlinks, dirs=dirs,
-            exclude=exclude, memoize=memoize)
-        output = {
-            path: stats for path, stats in output.items()
-            if os.path.commonpath((path, rel_util_path)) != rel_util_path}
-        return output
-
 
 class RemoteDBFile(SyncDBFile):
     """Manipulate the remote file database.
@@ -256,10 +275,21 @@ class RemoteDBFile(SyncDBFile):
     hierarchy.
 
     Attributes:
+        _CONNECTION_PRAGMAS: A script of pragmas that must be set every time a
+            connection to the database is opened. The database may be on a
+            network file system and shared between clients, so it stays in
+            rollback journal mode with full syncing and no memory map. Only
+            the page cache and temporary storage are tuned.
         path: The path of the database file.
         _conn: The sqlite connection object for the database.
         _cur: The sqlite cursor object for the connection.
     """
+    _CONNECTION_PRAGMAS = """\
+        PRAGMA foreign_keys = ON;
+        PRAGMA temp_store = MEMORY;
+        PRAGMA cache_size = -20000;
+        """
+
     def create(self) -> None:
         """Create a new empty database.
 
@@ -269,14 +299,9 @@ class RemoteDBFile(SyncDBFile):
         if os.path.isfile(self.path):
             raise FileExistsError("the database file already exists")
 
-        self._conn = sqlite3.connect(
-            self.path,
-            detect_types=sqlite3.PARSE_DECLTYPES,
-            isolation_level="DEFERRED")
-        self._conn.create_function("gen_salt", 0, lambda: secure_string(8))
-
-        self._cur = self._conn.cursor()
-        self._cur.arraysize = 20
+        # A connection may still be open to a database file that has since
+        # been deleted.
+        self._reconnect()
 
         with self._transact():
             self._cur.executescript("""\
@@ -306,6 +331,12 @@ class RemoteDBFile(SyncDBFile):
                     salt        TEXT    NOT NULL,
                     PRIMARY KEY (path) ON CONFLICT IGNORE
                 );
+
+                CREATE INDEX closure_descendant
+                ON closure (descendant, depth);
+
+                CREATE INDEX nodes_lastsync
+                ON nodes (lastsync);
                 """)
 
     def add_paths(self, files: Iterable[str], dirs: Iterable[str]) -> None:
@@ -321,64 +352,22 @@ class RemoteDBFile(SyncDBFile):
             files: The paths of regular files to add to the database.
             dirs: The paths of directories to add to the database.
         """
-        # Sort paths by depth. A file can't be added to the database until its
-        # parent directory has been added.
-        files = set(files)
-        dirs = set(dirs)
-        paths = list(files | dirs)
-        paths.sort(key=lambda x: x.count(os.sep))
-        timestamp = time.time()
-
-        while True:
-            parents = set()
-            insert_nodes_vals = []
-            insert_closure_vals = []
-            rm_vals = []
-            for path in paths:
-                path_id = self._get_path_id(path)
-                parent = os.path.dirname(path)
-                if parent:
-                    parents.add(parent)
-                    parent_id = self._get_path_id(parent)
-                else:
-                    parent_id = path_id
-
-                rm_vals.append({
-                    "path_id": path_id})
-                insert_nodes_vals.append({
-                    "path": path,
-                    "path_id": path_id,
-                    "directory": bool(path in dirs),
-                    "lastsync": timestamp})
-                insert_closure_vals.append({
-                    "path_id": path_id,
-                    "parent_id": parent_id})
-
-            # If there are any hash collisions with paths already in the
-            # database, generate salt and continue the loop to regenerate
-            # the path IDs.
-            self._cur.executemany("""\
-                INSERT INTO collisions (path, salt)
-                SELECT :path, gen_salt()
-                FROM nodes
-                WHERE id = :path_id
-                AND path != :path;
-                """, insert_nodes_vals)
-            if self._cur.rowcount <= 0:
-                break
+        depths = self._stage_paths(files, dirs)
 
         # Insert new values into both tables.
-        self._cur.executemany("""\
+        self._cur.execute("""\
             INSERT INTO nodes (id, path, directory, lastsync)
-            VALUES (:path_id, :path, :directory, :lastsync);
-            """, insert_nodes_vals)
-        self._cur.executemany("""\
-            INSERT INTO closure (ancestor, descendant, depth)
-            SELECT ancestor, :path_id, c.depth + 1
-            FROM closure AS c
-            WHERE descendant = :parent_id
-            UNION ALL SELECT :path_id, :path_id, 0;
-            """, insert_closure_vals)
+            SELECT id, path, directory, :lastsync
+            FROM incoming;
+            """, {"lastsync": time.time()})
+        self._insert_closure(depths)
+
+        self._cur.execute("""\
+            SELECT DISTINCT parent
+            FROM incoming
+            WHERE parent != '';
+            """)
+        parents = [parent for parent, in self._cur.fetchall()]
         self._mark_directory(parents)
 
     def update_paths(
@@ -392,29 +381,30 @@ class RemoteDBFile(SyncDBFile):
             lastsync: The time that the paths were last updated by a sync. Use
                 None to leave the value unchanged.
         """
-        update_vals = []
-        for path in paths:
-            path_id = self._get_path_id(path)
+        # Only the columns that are being changed are set, so that all of them
+        # can be updated in a single statement.
+        set_clause = ", ".join(
+            "{0} = :{0}".format(column) for column, value in [
+                ("directory", directory),
+                ("lastsync", lastsync)]
+            if value is not None)
+        if not set_clause:
+            return
 
-            update_vals.append({
-                "path_id": path_id,
+        self._cur.execute("""\
+            UPDATE nodes
+            SET {0}
+            WHERE id IN (
+                SELECT path_id(j.value, (
+                    SELECT salt
+                    FROM collisions
+                    WHERE path = j.value))
+                FROM json_each(:paths) AS j);
+            """.format(set_clause), {
+                "paths": json.dumps(list(paths)),
                 "directory": directory,
                 "lastsync": lastsync})
 
-        if directory is not None:
-            self._cur.executemany("""\
-                UPDATE nodes
-                SET directory = :directory
-                WHERE id = :path_id;
-                """, update_vals)
-
-        if lastsync is not None:
-            self._cur.executemany("""\
-                UPDATE nodes
-                SET lastsync = :lastsync
-                WHERE id = :path_id;
-                """, update_vals)
-
     def rm_paths(self, paths: Iterable[str]) -> None:
         """Remove file paths from the database.
 
@@ -424,21 +414,20 @@ class RemoteDBFile(SyncDBFile):
         Args:
             paths: The file paths to remove.
         """
-        # A generator expression can't be used here because recursive use of
-        # cursors is not allowed.
-        rm_vals = [{
-            "path_id": self._get_path_id(path)}
-            for path in paths]
-
-        self._cur.executemany("""\
+        # The paths are passed in as a JSON array and their IDs are generated
+        # in SQL instead of binding a parameter dict for each path.
+        self._cur.execute("""\
             DELETE FROM nodes
             WHERE id IN (
-                SELECT n.id
-                FROM nodes AS n
-                JOIN closure AS c
-                ON (n.id = c.descendant)
-                WHERE c.ancestor = :path_id);
-            """, rm_vals)
+                SELECT c.descendant
+                FROM closure AS c
+                WHERE c.ancestor IN (
+                    SELECT path_id(j.value, (
+                        SELECT salt
+                        FROM collisions
+                        WHERE path = j.value))
+                    FROM json_each(:paths) AS j));
+            """, {"paths": json.dumps(list(paths))})
         self._cur.execute("""
             DELETE FROM collisions
             WHERE path NOT IN (
@@ -468,6 +457,45 @@ class RemoteDBFile(SyncDBFile):
         if result:
             return PathData(*result)
 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _get_paths_query(
+            root: bool, directory: bool, min_lastsync: bool) -> str:
+        """Build a query for get_paths() with only the filters that are used.
+
+        Leaving out unused filters lets the query planner use the lastsync
+        index when only recently synced paths are wanted, and the closure
+        table doesn't need to be joined at all if there is no root.
+
+        Args:
+            root: Restrict results to paths under the directory ':start_id'.
+            directory: Restrict results based on the value of ':directory'.
+            min_lastsync: Restrict results based on the value of
+                ':min_lastsync'.
+
+        Returns:
+            The SQL query string.
+        """
+        query = """\
+            SELECT n.path, n.directory, n.lastsync
+            FROM nodes AS n
+            """
+        conditions = []
+        if root:
+            query += """\
+            JOIN closure AS c
+            ON (n.id = c.descendant)
+            """
+            conditions.append("c.ancestor = :start_id")
+        if directory:
+            conditions.append("n.directory = :directory")
+        if min_lastsync:
+            conditions.append("n.lastsync > :min_lastsync")
+        if conditions:
+            query += "WHERE " + " AND ".join(conditions)
+
+        return query + ";"
+
     def get_paths(
             self, root=None, directory=None, min_lastsync=None
             ) -> Dict[str, PathData]:
@@ -488,20 +516,15 @@ class RemoteDBFile(SyncDBFile):
             sync as a unix timestamp.
         """
         start_id = self._get_path_id(root) if root else None
-        self._cur.execute("""\
-            SELECT n.path, n.directory, n.lastsync
-            FROM nodes AS n
-            JOIN closure AS c
-            ON (n.id = c.descendant)
-            WHERE (:start_id IS NULL OR c.ancestor = :start_id)
-            AND (:directory IS NULL OR n.directory = :directory)
-            AND (:min_lastsync IS NULL OR n.lastsync > :min_lastsync);
-            """, {"start_id": start_id, "directory": directory,
-                  "min_lastsync": min_lastsync})
-
-        # As long as self._cur.arraysize is greater than 1, fetchmany() should
-        # be more efficient than fetchall().
+        query = self._get_paths_query(
+            start_id is not None, directory is not None,
+            min_lastsync is not None)
+        self._cur.execute(query, {
+            "start_id": start_id, "directory": directory,
+            "min_lastsync": min_lastsync})
+
+        # The whole result set is needed, so build it in one fetchall() call
+        # instead of looping over fetchmany() batches.
+        make_data = PathData._make
         return {
-            path: PathData(directory, lastsync)
-            for array in iter(self._cur.fetchmany, [])
-            for path, directory, lastsync in array}
+            row[0]: make_data(row[1:]) for row in self._cur.fetchall()}
@@ -28,7 +28,8 @@ import datetime
 import random
 import string
 import readline
-from typing import List, Tuple, Iterable
+import functools
+from typing import List, Tuple
 
 from zielen.paths import get_home_dir
 
@@ -68,30 +69,20 @@ def timestamp_path(path: str, keyword="") -> str:
     return "{0}_{1}{2}{3}".format(name, keyword, timestamp, extension)
 
 
-def get_path_ancestry(paths: Iterable[str]) -> List[str]:
-    """For each path given, get all parent directories up to the root.
+@functools.lru_cache(maxsize=None)
+def get_version() -> str:
+    """Get the version number of the installed program.
 
-    Args:
-        paths: The paths to get the ancestors of.
-
-    Returns:
-        A deduplicated list of paths sorted by depth from leaf to trunk.
+    Looking up package metadata is slow, so the result is cached.
     """
-    # A deque is used here because a list cannot be appended to while it is
-    # being iterated over.
-    path_queue = collections.deque(paths)
-    output_paths = set()
-    while len(path_queue) > 0:
-        path = path_queue.pop()
-        output_paths.add(path)
-        parent = os.path.dirname(path)
-        if parent:
-            path_queue.appendleft(parent)
-
-    # Sort paths by depth.
-    sorted_paths = list(sorted(
-        output_paths, key=lambda x: x.count(os.sep), reverse=True))
-    return sorted_paths
+    try:
+        from importlib.metadata import version
+    except ImportError:
+        # The importlib.metadata module was added in Python 3.8.
+        import pkg_resources
+        return pkg_resources.get_distribution("zielen").version
+
+    return version("zielen")
 
 
 def secure_string(length: int) -> str:
@@ -197,6 +188,28 @@ class DictProperty:
         return type(self)(self._fget, self._fset, fdel, self.__doc__)
 
 
+class CachedProperty:
+    """A read-only property that is only computed the first time it's accessed.
+
+    The computed values are stored in the '_cached_vals' dict of the instance,
+    which can be cleared to recompute them.
+    """
+    def __init__(self, fget):
+        self._fget = fget
+        self._name = fget.__name__
+        self.__doc__ = fget.__doc__
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            return obj._cached_vals[self._name]
+        except KeyError:
+            value = self._fget(obj)
+            obj._cached_vals[self._name] = value
+            return value
+
+
 class ProgressBar:
     """An ascii progress bar for the terminal.
 